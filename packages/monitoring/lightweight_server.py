@@ -3,8 +3,9 @@
 Lightweight monitoring server without heavy dependencies
 """
 
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify, stream_with_context
 from flask_cors import CORS
+from metrics_stream import MetricsHub, load_baseline, load_row_totals, normalize_trace
 import json
 import sqlite3
 from datetime import datetime
@@ -45,31 +46,47 @@ class LightweightMonitor:
         conn.close()
     
     def log_trace(self, trace_data):
-        """Log AI agent trace data"""
+        """Log AI agent trace data, returning what the row it replaced contributed (if any)"""
+        # Store the same coerced values the live metrics hub counts
+        trace_data = normalize_trace(trace_data)
+        trace_id = trace_data.get('trace_id', datetime.now().isoformat())
+        
         conn = sqlite3.connect(self.db_path)
         cursor = conn.cursor()
         
-        cursor.execute("""
-            INSERT OR REPLACE INTO traces 
-            (id, timestamp, question, tools_used, sources_count, 
-             response_length, latency_ms, error, metadata)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-        """, (
-            trace_data.get('trace_id', datetime.now().isoformat()),
-            trace_data.get('timestamp', datetime.now().isoformat()),
-            trace_data.get('question', ''),
-            json.dumps(trace_data.get('tools_used', [])),
-            trace_data.get('sources_count', 0),
-            trace_data.get('response_length', 0),
-            trace_data.get('latency_ms', 0),
-            trace_data.get('error', ''),
-            json.dumps(trace_data.get('metadata', {}))
-        ))
-        
-        conn.commit()
-        conn.close()
+        try:
+            # Same trace_id replaces the row; callers need the old values, so read
+            # and replace inside one write transaction
+            cursor.execute("BEGIN IMMEDIATE")
+            replaced = load_row_totals(cursor, trace_id)
+            
+            cursor.execute("""
+                INSERT OR REPLACE INTO traces 
+                (id, timestamp, question, tools_used, sources_count, 
+                 response_length, latency_ms, error, metadata)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """, (
+                trace_id,
+                trace_data.get('timestamp', datetime.now().isoformat()),
+                trace_data.get('question', ''),
+                json.dumps(trace_data.get('tools_used', [])),
+                trace_data.get('sources_count', 0),
+                trace_data.get('response_length', 0),
+                trace_data.get('latency_ms', 0),
+                trace_data.get('error', ''),
+                json.dumps(trace_data.get('metadata', {}))
+            ))
+            
+            conn.commit()
+        except Exception:
+            # Release the write lock now rather than when the connection is collected
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
         
-        print(f"📊 Logged trace: {trace_data.get('trace_id', 'unknown')}")
+        print(f"📊 Logged trace: {trace_id}")
+        return replaced
     
     def get_metrics(self):
         """Get monitoring metrics"""
@@ -120,6 +137,9 @@ class LightweightMonitor:
 # Global monitor instance
 monitor = LightweightMonitor()
 
+# Live metrics hub, seeded from SQLite once and kept current by /log_trace
+metrics_hub = MetricsHub(load_baseline(monitor.db_path))
+
 @app.route('/health', methods=['GET'])
 def health():
     """Health check endpoint"""
@@ -130,10 +150,17 @@ def log_trace():
     """Log AI agent trace data"""
     try:
         trace_data = request.get_json()
-        monitor.log_trace(trace_data)
-        return jsonify({'status': 'success'})
+        replaced = monitor.log_trace(trace_data)
     except Exception as e:
         return jsonify({'error': str(e)}), 500
+    
+    # The trace is stored; a live-stream failure must not fail the request
+    try:
+        metrics_hub.publish_trace(trace_data, replaced)
+    except Exception as e:
+        print(f"⚠️ Could not publish trace to metrics stream: {e}")
+    
+    return jsonify({'status': 'success'})
 
 @app.route('/metrics', methods=['GET'])
 def get_metrics():
@@ -144,6 +171,21 @@ def get_metrics():
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/metrics/stream', methods=['GET'])
+def metrics_stream():
+    """Stream live metric deltas as Server-Sent Events"""
+    if not metrics_hub.try_subscribe():
+        return jsonify({'error': 'Too many open metrics streams'}), 503
+    
+    response = Response(
+        stream_with_context(metrics_hub.stream()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+    # Runs even when the body is never iterated (HEAD, early disconnect)
+    response.call_on_close(metrics_hub.release)
+    return response
+
 @app.route('/dashboard', methods=['GET'])
 def dashboard():
     """Get dashboard data"""
@@ -161,5 +203,6 @@ if __name__ == '__main__':
     print("🌟 Starting Lightweight Energy Advisor Monitoring...")
     print("🔗 API Server at http://localhost:6007")
     print("📊 Simple dashboard at http://localhost:6007/dashboard")
+    print("📡 Live metrics stream at http://localhost:6007/metrics/stream")
     
-    app.run(host='0.0.0.0', port=6007, debug=True)
\ No newline at end of file
+    app.run(host='0.0.0.0', port=6007, debug=True, threaded=True)
\ No newline at end of file
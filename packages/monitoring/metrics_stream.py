@@ -0,0 +1,297 @@
+#!/usr/bin/env python3
+"""
+Live metrics stream for Energy Advisor monitoring
+In-process pub/sub hub that pushes incremental metric deltas to SSE clients
+"""
+
+from collections import deque
+from typing import Dict, Any, Iterator, Optional
+import json
+import math
+import sqlite3
+import threading
+import time
+
+# Upper bounds (ms) of the latency histogram buckets; slower traces land in the last one
+LATENCY_BUCKETS_MS = [250, 500, 1000, 2500, 5000, 10000]
+OVERFLOW_BUCKET = f"gt_{LATENCY_BUCKETS_MS[-1]}"
+
+def latency_bucket(latency_ms: float) -> str:
+    """Get the histogram bucket label for a latency"""
+    for bound in LATENCY_BUCKETS_MS:
+        if latency_ms <= bound:
+            return f"le_{bound}"
+    return OVERFLOW_BUCKET
+
+def to_number(value: Any) -> float:
+    """Coerce a numeric trace field; numeric strings and bools convert, anything else is 0"""
+    if isinstance(value, bool):
+        return int(value)
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        return 0
+    if not math.isfinite(number):
+        return 0
+    return int(number) if number.is_integer() else number
+
+def normalize_trace(trace_data: Dict[str, Any]) -> Dict[str, Any]:
+    """Coerce the fields the metrics are built from, before the trace is stored
+
+    Both log_trace implementations store the normalized trace and the hub
+    counts the same values, so live totals and the traces table agree.
+    """
+    trace = dict(trace_data)
+    for field in ('latency_ms', 'sources_count', 'response_length'):
+        trace[field] = to_number(trace.get(field, 0))
+    error = trace.get('error', '')
+    trace['error'] = '' if error is None else str(error)
+    return trace
+
+# Per-trace contributions to the running totals. load_baseline and load_row_totals
+# share these so stored rows (including legacy TEXT values) follow SQLite's rules
+TOTALS_SQL = """
+    SELECT COUNT(*),
+           SUM(CASE WHEN error != '' THEN 1 ELSE 0 END),
+           SUM(CASE WHEN latency_ms > 0 THEN latency_ms ELSE 0 END),
+           SUM(CASE WHEN latency_ms > 0 THEN 1 ELSE 0 END),
+           SUM(CASE WHEN sources_count > 0 THEN sources_count ELSE 0 END),
+           SUM(CASE WHEN sources_count > 0 THEN 1 ELSE 0 END)
+    FROM traces
+"""
+
+BUCKETS_SQL = """
+    SELECT CASE {cases} ELSE '{overflow}' END AS bucket, COUNT(*)
+    FROM traces
+    WHERE latency_ms > 0
+""".format(
+    cases=" ".join(
+        f"WHEN latency_ms <= {bound} THEN 'le_{bound}'" for bound in LATENCY_BUCKETS_MS
+    ),
+    overflow=OVERFLOW_BUCKET,
+)
+
+def read_totals(cursor: sqlite3.Cursor, trace_id: Optional[str] = None) -> Dict[str, Any]:
+    """Sum the traces table, or just one row of it"""
+    where, params = ("", ())
+    if trace_id is not None:
+        where, params = (" id = ?", (trace_id,))
+
+    cursor.execute(TOTALS_SQL + (" WHERE" + where if where else ""), params)
+    row = cursor.fetchone()
+
+    cursor.execute(BUCKETS_SQL + (" AND" + where if where else "") + " GROUP BY bucket", params)
+    buckets = dict(cursor.fetchall())
+
+    return {
+        'total_requests': row[0] or 0,
+        'error_count': row[1] or 0,
+        'latency_sum_ms': row[2] or 0,
+        'latency_count': row[3] or 0,
+        'sources_sum': row[4] or 0,
+        'sources_count': row[5] or 0,
+        'latency_buckets': buckets,
+    }
+
+def load_baseline(db_path: str) -> Dict[str, Any]:
+    """Read running totals from the traces table once, at hub startup"""
+    conn = sqlite3.connect(db_path)
+    try:
+        return read_totals(conn.cursor())
+    finally:
+        conn.close()
+
+def load_row_totals(cursor: sqlite3.Cursor, trace_id: str) -> Optional[Dict[str, Any]]:
+    """Get what a stored trace contributes to the totals, or None if it isn't stored"""
+    totals = read_totals(cursor, trace_id)
+    return totals if totals['total_requests'] else None
+
+class MetricsHub:
+    def __init__(self, baseline: Optional[Dict[str, Any]] = None,
+                 coalesce_interval_s: float = 1.0,
+                 keepalive_interval_s: float = 15.0,
+                 max_clients: int = 500,
+                 recent_errors_size: int = 20):
+        """Initialize the hub from baseline totals (see load_baseline)"""
+        baseline = baseline or {}
+        self.coalesce_interval_s = coalesce_interval_s
+        self.keepalive_interval_s = keepalive_interval_s
+        self.max_clients = max_clients
+
+        self._condition = threading.Condition(threading.Lock())
+        self._version = 0
+        self._clients = 0
+        self._totals = {
+            'total_requests': baseline.get('total_requests', 0),
+            'error_count': baseline.get('error_count', 0),
+            'latency_sum_ms': baseline.get('latency_sum_ms', 0),
+            'latency_count': baseline.get('latency_count', 0),
+            'sources_sum': baseline.get('sources_sum', 0),
+            'sources_count': baseline.get('sources_count', 0),
+        }
+        self._buckets = {
+            f"le_{bound}": 0 for bound in LATENCY_BUCKETS_MS
+        }
+        self._buckets[OVERFLOW_BUCKET] = 0
+        self._buckets.update(baseline.get('latency_buckets', {}))
+
+        # Sequence-numbered so each client can pick up only errors it hasn't seen
+        self._error_seq = 0
+        self._recent_errors = deque(maxlen=recent_errors_size)
+
+    def publish_trace(self, trace_data: Dict[str, Any],
+                      replaced: Optional[Dict[str, Any]] = None):
+        """Fold one ingested trace into the running totals and wake subscribers
+
+        replaced is what the row this trace overwrote (same trace_id)
+        contributed, from load_row_totals; it is swapped out so totals keep
+        matching the traces table.
+        """
+        # Coerce everything up front so a bad field can't leave totals half-updated
+        trace = normalize_trace(trace_data)
+        added = self._contribution(trace)
+        error_entry = {
+            'trace_id': str(trace.get('trace_id', '')),
+            'timestamp': str(trace.get('timestamp', '')),
+            'error': trace['error'],
+        }
+
+        with self._condition:
+            if replaced:
+                self._apply(replaced, -1)
+            self._apply(added, 1)
+
+            if trace['error']:
+                self._error_seq += 1
+                self._recent_errors.append((self._error_seq, error_entry))
+
+            self._version += 1
+            self._condition.notify_all()
+
+    def _contribution(self, trace: Dict[str, Any]) -> Dict[str, Any]:
+        """Get what one normalized trace adds to the totals, in read_totals' shape"""
+        latency_ms = trace['latency_ms']
+        sources = trace['sources_count']
+        return {
+            'total_requests': 1,
+            'error_count': 1 if trace['error'] else 0,
+            'latency_sum_ms': latency_ms if latency_ms > 0 else 0,
+            'latency_count': 1 if latency_ms > 0 else 0,
+            'sources_sum': sources if sources > 0 else 0,
+            'sources_count': 1 if sources > 0 else 0,
+            'latency_buckets': {latency_bucket(latency_ms): 1} if latency_ms > 0 else {},
+        }
+
+    def _apply(self, totals: Dict[str, Any], sign: int):
+        """Add (sign=1) or remove (sign=-1) totals; caller must hold self._condition"""
+        for key in self._totals:
+            self._totals[key] += sign * totals.get(key, 0)
+        for label, count in totals.get('latency_buckets', {}).items():
+            self._buckets[label] += sign * count
+
+    def _state(self) -> Dict[str, Any]:
+        """Copy the current totals; caller must hold self._condition"""
+        return {
+            'version': self._version,
+            'totals': dict(self._totals),
+            'buckets': dict(self._buckets),
+            'error_seq': self._error_seq,
+        }
+
+    def _summary(self, totals: Dict[str, Any]) -> Dict[str, Any]:
+        """Derive the dashboard metrics from running totals"""
+        total_requests = totals['total_requests']
+        return {
+            'total_requests': total_requests,
+            'avg_latency_ms': round(totals['latency_sum_ms'] / max(totals['latency_count'], 1), 2),
+            'error_rate': round(totals['error_count'] / max(total_requests, 1) * 100, 2),
+            'avg_sources_used': round(totals['sources_sum'] / max(totals['sources_count'], 1), 2),
+        }
+
+    def _delta(self, previous: Dict[str, Any], current: Dict[str, Any]) -> Dict[str, Any]:
+        """Diff two states; everything published in between is coalesced into one delta"""
+        with self._condition:
+            new_errors = [
+                entry for seq, entry in self._recent_errors
+                if previous['error_seq'] < seq <= current['error_seq']
+            ]
+
+        return {
+            'new_requests': current['totals']['total_requests'] - previous['totals']['total_requests'],
+            'new_errors': current['totals']['error_count'] - previous['totals']['error_count'],
+            'latency_buckets': {
+                label: count - previous['buckets'][label]
+                for label, count in current['buckets'].items()
+                if count != previous['buckets'][label]
+            },
+            'errors': new_errors,
+            'metrics': self._summary(current['totals']),
+        }
+
+    def snapshot(self, state: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """Get the full current metrics without touching the database"""
+        with self._condition:
+            state = state or self._state()
+            recent_errors = [
+                entry for seq, entry in self._recent_errors if seq <= state['error_seq']
+            ]
+
+        return {
+            'metrics': self._summary(state['totals']),
+            'latency_buckets': state['buckets'],
+            'recent_errors': recent_errors,
+            'clients': self._clients,
+        }
+
+    def try_subscribe(self) -> bool:
+        """Reserve a client slot; False once max_clients are connected"""
+        with self._condition:
+            if self._clients >= self.max_clients:
+                return False
+            self._clients += 1
+            return True
+
+    def release(self):
+        """Free a slot reserved with try_subscribe"""
+        with self._condition:
+            self._clients -= 1
+
+    def stream(self) -> Iterator[str]:
+        """Yield SSE frames for one client slot reserved with try_subscribe
+
+        The slot is not freed here: a generator closed before its first
+        frame (e.g. a HEAD request) never runs its cleanup, so callers
+        must call release() when the response closes.
+        """
+        with self._condition:
+            last = self._state()
+        yield self._event('snapshot', self.snapshot(last))
+
+        last_sent = time.monotonic()
+        while True:
+            with self._condition:
+                # Nothing queues per client: a slow reader just sees a bigger delta
+                self._condition.wait_for(
+                    lambda: self._version != last['version'],
+                    timeout=self.keepalive_interval_s,
+                )
+                changed = self._version != last['version']
+
+            if not changed:
+                yield ": keepalive\n\n"
+                continue
+
+            # Hold off so bursts of traces reach this client as one delta
+            wait_s = last_sent + self.coalesce_interval_s - time.monotonic()
+            if wait_s > 0:
+                time.sleep(wait_s)
+
+            with self._condition:
+                current = self._state()
+            yield self._event('delta', self._delta(last, current))
+            last = current
+            last_sent = time.monotonic()
+
+    def _event(self, name: str, data: Dict[str, Any]) -> str:
+        """Format one Server-Sent Event frame"""
+        return f"event: {name}\ndata: {json.dumps(data)}\n\n"
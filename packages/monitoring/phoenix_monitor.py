@@ -5,11 +5,14 @@ Free monitoring without API keys
 """
 
 import phoenix as px
-from phoenix.trace import using_project
+from opentelemetry.sdk.resources import Resource
+from opentelemetry.sdk.trace import TracerProvider
+from span_exporter import build_trace_span, create_span_processor
+from metrics_stream import load_row_totals, normalize_trace
 import json
 import sqlite3
 from datetime import datetime
-from typing import Dict, List, Any
+from typing import Dict, List, Any, Optional
 import os
 
 class EnergyAdvisorMonitor:
@@ -21,6 +24,16 @@ class EnergyAdvisorMonitor:
         self.session = px.launch_app(port=6006)
         print(f"🔍 Phoenix monitoring started at: {self.session.url}")
         
+        # Spans are exported in batches by a background worker so
+        # log_trace never waits on the collector
+        self.span_processor = create_span_processor()
+        self.tracer_provider = TracerProvider(resource=Resource.create({
+            "service.name": project_name,
+            "openinference.project.name": project_name,
+        }))
+        self.tracer_provider.add_span_processor(self.span_processor)
+        self.tracer = self.tracer_provider.get_tracer("energy-advisor.monitoring")
+        
         # Setup SQLite for local trace storage
         self.db_path = "monitoring/traces.db"
         self.init_database()
@@ -49,15 +62,21 @@ class EnergyAdvisorMonitor:
         conn.commit()
         conn.close()
     
-    def log_trace(self, trace_data: Dict[str, Any]):
-        """Log AI agent trace data"""
+    def log_trace(self, trace_data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """Log AI agent trace data, returning what the row it replaced contributed (if any)"""
+        # Store the same coerced values the live metrics hub counts
+        trace_data = normalize_trace(trace_data)
+        trace_id = trace_data.get('trace_id', datetime.now().isoformat())
         
-        with using_project(self.project_name):
-            trace_id = trace_data.get('trace_id', datetime.now().isoformat())
-            
-            # Store in SQLite for persistence
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
+        # Store in SQLite for persistence
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+        
+        try:
+            # Same trace_id replaces the row; callers need the old values, so read
+            # and replace inside one write transaction
+            cursor.execute("BEGIN IMMEDIATE")
+            replaced = load_row_totals(cursor, trace_id)
             
             cursor.execute("""
                 INSERT OR REPLACE INTO traces 
@@ -77,9 +96,27 @@ class EnergyAdvisorMonitor:
             ))
             
             conn.commit()
+        except Exception:
+            # Release the write lock now rather than when the connection is collected
+            conn.rollback()
+            raise
+        finally:
             conn.close()
-            
-            print(f"📊 Logged trace: {trace_id}")
+        
+        # Only enqueues the span; export happens on the background worker.
+        # The row is already stored, so a bad span must not fail the request
+        try:
+            self.emit_span(trace_id, trace_data)
+        except Exception as e:
+            self.span_processor.record_build_failure(str(e))
+            print(f"⚠️ Could not emit span for trace {trace_id}: {e}")
+        
+        print(f"📊 Logged trace: {trace_id}")
+        return replaced
+    
+    def emit_span(self, trace_id: str, trace_data: Dict[str, Any]):
+        """Build an OpenTelemetry span from AI agent trace data"""
+        build_trace_span(self.tracer, trace_id, trace_data)
     
     def get_metrics(self) -> Dict[str, Any]:
         """Get monitoring metrics"""
@@ -106,7 +143,8 @@ class EnergyAdvisorMonitor:
             'avg_latency_ms': round(avg_latency, 2),
             'error_rate': round(error_count / max(total_requests, 1) * 100, 2),
             'avg_sources_used': round(avg_sources, 2),
-            'phoenix_url': self.session.url
+            'phoenix_url': self.session.url,
+            'span_export': self.span_processor.get_stats()
         }
 
 # Global monitor instance
@@ -119,12 +157,12 @@ def init_monitor():
         monitor = EnergyAdvisorMonitor()
     return monitor
 
-def log_ai_trace(trace_data: Dict[str, Any]):
-    """Log AI agent trace"""
+def log_ai_trace(trace_data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """Log AI agent trace, returning what the row it replaced contributed (if any)"""
     global monitor
     if monitor is None:
         monitor = init_monitor()
-    monitor.log_trace(trace_data)
+    return monitor.log_trace(trace_data)
 
 def get_monitoring_metrics():
     """Get current monitoring metrics"""
@@ -133,6 +171,13 @@ def get_monitoring_metrics():
         monitor = init_monitor()
     return monitor.get_metrics()
 
+def get_span_export_stats():
+    """Get background span export statistics"""
+    global monitor
+    if monitor is None:
+        monitor = init_monitor()
+    return monitor.span_processor.get_stats()
+
 if __name__ == "__main__":
     # Start Phoenix monitoring server
     monitor = init_monitor()
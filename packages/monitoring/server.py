@@ -4,14 +4,15 @@ Monitoring API server for Energy Advisor
 Integrates Phoenix monitoring and RAGAS evaluation
 """
 
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify, stream_with_context
 from flask_cors import CORS
 import threading
 import time
 
 # Import our monitoring modules
-from phoenix_monitor import init_monitor, log_ai_trace, get_monitoring_metrics
+from phoenix_monitor import init_monitor, log_ai_trace, get_monitoring_metrics, get_span_export_stats
 from ragas_evaluator import init_evaluator, evaluate_qa_batch, get_evaluation_summary
+from metrics_stream import MetricsHub, load_baseline
 
 app = Flask(__name__)
 CORS(app)
@@ -20,6 +21,7 @@ CORS(app)
 print("🚀 Initializing monitoring services...")
 monitor = init_monitor()
 evaluator = init_evaluator()
+metrics_hub = MetricsHub(load_baseline(monitor.db_path))
 print("✅ Monitoring services ready!")
 
 @app.route('/health', methods=['GET'])
@@ -32,10 +34,17 @@ def log_trace():
     """Log AI agent trace data"""
     try:
         trace_data = request.get_json()
-        log_ai_trace(trace_data)
-        return jsonify({'status': 'success'})
+        replaced = log_ai_trace(trace_data)
     except Exception as e:
         return jsonify({'error': str(e)}), 500
+    
+    # The trace is stored; a live-stream failure must not fail the request
+    try:
+        metrics_hub.publish_trace(trace_data, replaced)
+    except Exception as e:
+        print(f"⚠️ Could not publish trace to metrics stream: {e}")
+    
+    return jsonify({'status': 'success'})
 
 @app.route('/evaluate', methods=['POST'])
 def evaluate():
@@ -67,6 +76,29 @@ def get_metrics():
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/metrics/stream', methods=['GET'])
+def metrics_stream():
+    """Stream live metric deltas as Server-Sent Events"""
+    if not metrics_hub.try_subscribe():
+        return jsonify({'error': 'Too many open metrics streams'}), 503
+    
+    response = Response(
+        stream_with_context(metrics_hub.stream()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+    # Runs even when the body is never iterated (HEAD, early disconnect)
+    response.call_on_close(metrics_hub.release)
+    return response
+
+@app.route('/export_stats', methods=['GET'])
+def export_stats():
+    """Get span export throughput and drop statistics"""
+    try:
+        return jsonify(get_span_export_stats())
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/dashboard', methods=['GET'])
 def dashboard():
     """Get dashboard data"""
@@ -81,4 +113,4 @@ if __name__ == '__main__':
     print("📊 Phoenix Dashboard will be available at the URL shown above")
     print("🔗 API Server starting on http://localhost:6007")
     
-    app.run(host='0.0.0.0', port=6007, debug=True)
\ No newline at end of file
+    app.run(host='0.0.0.0', port=6007, debug=True, threaded=True)
\ No newline at end of file
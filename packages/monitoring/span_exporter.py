@@ -0,0 +1,243 @@
+#!/usr/bin/env python3
+"""
+Batched background span export for Energy Advisor monitoring
+Ships OpenTelemetry spans to a local OTLP collector (Phoenix) off the request path
+"""
+
+from opentelemetry.sdk.trace import ReadableSpan, SpanProcessor
+from opentelemetry.sdk.trace.export import SpanExporter, SpanExportResult
+from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+from opentelemetry.trace import Status, StatusCode, Tracer
+from metrics_stream import to_number
+from collections import deque
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Any, Optional
+import json
+import threading
+import time
+import os
+
+DEFAULT_OTLP_ENDPOINT = "http://localhost:6006/v1/traces"
+
+class BatchingSpanProcessor(SpanProcessor):
+    def __init__(self, exporter: SpanExporter,
+                 max_queue_size: int = 2048,
+                 max_batch_size: int = 256,
+                 flush_interval_s: float = 2.0):
+        """Queue finished spans and export them in batches from a worker thread"""
+        self.exporter = exporter
+        self.max_queue_size = max_queue_size
+        self.max_batch_size = min(max_batch_size, max_queue_size)
+        self.flush_interval_s = flush_interval_s
+
+        self._queue = deque()
+        self._condition = threading.Condition(threading.Lock())
+        self._shutdown = threading.Event()
+        self._flush_requests: List[threading.Event] = []
+
+        # Export counters, guarded by self._condition
+        self._started_at = time.monotonic()
+        self._stats = {
+            'spans_enqueued': 0,
+            'spans_exported': 0,
+            'spans_dropped': 0,
+            'spans_failed': 0,
+            'spans_build_failed': 0,
+            'batches_exported': 0,
+            'batches_failed': 0,
+            'last_export_ms': 0.0,
+            'last_error': '',
+        }
+
+        self._worker = threading.Thread(
+            target=self._run, name="span-exporter", daemon=True
+        )
+        self._worker.start()
+
+    def on_start(self, span, parent_context=None):
+        """Nothing to do until the span has ended"""
+        pass
+
+    def on_end(self, span: ReadableSpan):
+        """Enqueue a finished span without ever blocking the caller"""
+        if self._shutdown.is_set():
+            return
+
+        with self._condition:
+            if len(self._queue) >= self.max_queue_size:
+                self._stats['spans_dropped'] += 1
+                return
+
+            self._queue.append(span)
+            self._stats['spans_enqueued'] += 1
+
+            # Wake the worker early once a full batch is waiting
+            if len(self._queue) >= self.max_batch_size:
+                self._condition.notify()
+
+    def _run(self):
+        """Worker loop: flush on batch size, interval, or explicit request"""
+        last_flush = time.monotonic()
+        while True:
+            with self._condition:
+                deadline = last_flush + self.flush_interval_s
+                while (len(self._queue) < self.max_batch_size
+                       and not self._flush_requests
+                       and not self._shutdown.is_set()):
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._condition.wait(remaining)
+
+                flush_requests = self._flush_requests
+                self._flush_requests = []
+                shutting_down = self._shutdown.is_set()
+
+            # A flush or shutdown drains everything; otherwise one batch per wake-up
+            self._export_pending(drain=bool(flush_requests) or shutting_down)
+            last_flush = time.monotonic()
+
+            for flushed in flush_requests:
+                flushed.set()
+
+            if shutting_down:
+                break
+
+    def _export_pending(self, drain: bool):
+        """Pop queued spans in batches and hand them to the exporter"""
+        while True:
+            with self._condition:
+                batch = [
+                    self._queue.popleft()
+                    for _ in range(min(self.max_batch_size, len(self._queue)))
+                ]
+
+            if not batch:
+                return
+
+            self._export_batch(batch)
+
+            if not drain:
+                return
+
+    def _export_batch(self, batch: List[ReadableSpan]):
+        """Export a batch once; the exporter owns retries, so a failure is final"""
+        started = time.monotonic()
+        try:
+            result = self.exporter.export(batch)
+            error = '' if result == SpanExportResult.SUCCESS else 'export returned FAILURE'
+        except Exception as e:
+            error = str(e)
+        elapsed_ms = (time.monotonic() - started) * 1000
+
+        with self._condition:
+            self._stats['last_export_ms'] = round(elapsed_ms, 2)
+            if not error:
+                self._stats['spans_exported'] += len(batch)
+                self._stats['batches_exported'] += 1
+                return
+
+            self._stats['spans_failed'] += len(batch)
+            self._stats['batches_failed'] += 1
+            self._stats['last_error'] = error
+
+        print(f"⚠️ Span export failed, dropped {len(batch)} spans: {error}")
+
+    def record_build_failure(self, error: str):
+        """Count a trace whose span could not be built, so it shows up as dropped"""
+        with self._condition:
+            self._stats['spans_build_failed'] += 1
+            self._stats['last_error'] = error
+
+    def force_flush(self, timeout_millis: int = 30000) -> bool:
+        """Export everything queued so far, waiting up to the timeout"""
+        if self._shutdown.is_set():
+            return False
+
+        flushed = threading.Event()
+        with self._condition:
+            self._flush_requests.append(flushed)
+            self._condition.notify()
+
+        return flushed.wait(timeout_millis / 1000)
+
+    def shutdown(self):
+        """Drain the queue and stop the worker thread"""
+        if self._shutdown.is_set():
+            return
+
+        with self._condition:
+            self._shutdown.set()
+            self._condition.notify()
+
+        self._worker.join()
+        self.exporter.shutdown()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get export throughput and drop statistics"""
+        with self._condition:
+            stats = dict(self._stats)
+            stats['queue_size'] = len(self._queue)
+
+        uptime_s = max(time.monotonic() - self._started_at, 1e-6)
+        stats['queue_capacity'] = self.max_queue_size
+        stats['uptime_s'] = round(uptime_s, 2)
+        stats['export_throughput_spans_per_s'] = round(stats['spans_exported'] / uptime_s, 2)
+        lost = stats['spans_dropped'] + stats['spans_failed'] + stats['spans_build_failed']
+        offered = stats['spans_enqueued'] + stats['spans_dropped'] + stats['spans_build_failed']
+        stats['drop_rate'] = round(lost / max(offered, 1) * 100, 2)
+        return stats
+
+def build_trace_span(tracer: Tracer, trace_id: str, trace_data: Dict[str, Any]):
+    """Record one AI agent trace as a finished span"""
+    latency_ms = max(to_number(trace_data.get('latency_ms', 0)), 0)
+
+    # The agent stamps the trace when it finishes; fall back to "ended now"
+    try:
+        end = datetime.fromisoformat(trace_data['timestamp'].replace('Z', '+00:00'))
+        if end.tzinfo is None:
+            end = end.replace(tzinfo=timezone.utc)
+    except (KeyError, AttributeError, ValueError):
+        end = datetime.now(timezone.utc)
+    start = end - timedelta(milliseconds=latency_ms)
+
+    tools_used = trace_data.get('tools_used') or []
+    if isinstance(tools_used, (str, dict)) or not hasattr(tools_used, '__iter__'):
+        tools_used = [tools_used]
+
+    span = tracer.start_span(
+        "energy_advisor.analyze",
+        start_time=int(start.timestamp() * 1e9),
+        attributes={
+            "openinference.span.kind": "CHAIN",
+            "input.value": str(trace_data.get('question') or ''),
+            "energy_advisor.trace_id": str(trace_id),
+            "energy_advisor.tools_used": [str(tool) for tool in tools_used],
+            "energy_advisor.sources_count": to_number(trace_data.get('sources_count', 0)),
+            "energy_advisor.response_length": to_number(trace_data.get('response_length', 0)),
+            "energy_advisor.latency_ms": latency_ms,
+            "metadata": json.dumps(trace_data.get('metadata', {}), default=str),
+        },
+    )
+
+    error = trace_data.get('error') or ''
+    if error:
+        span.set_status(Status(StatusCode.ERROR, str(error)))
+    else:
+        span.set_status(Status(StatusCode.OK))
+
+    span.end(end_time=int(end.timestamp() * 1e9))
+
+def create_span_processor(endpoint: Optional[str] = None) -> BatchingSpanProcessor:
+    """Build a batching processor that ships spans to the local OTLP collector"""
+    endpoint = endpoint or os.environ.get("PHOENIX_COLLECTOR_ENDPOINT", DEFAULT_OTLP_ENDPOINT)
+    if not endpoint.rstrip("/").endswith("/v1/traces"):
+        endpoint = endpoint.rstrip("/") + "/v1/traces"
+    # Since 1.35 the OTLP exporter retries transient HTTP errors with backoff and
+    # stops once the timeout has passed, so one batch holds the worker ~5s at most.
+    # Which statuses count as transient, and whether refused connections are
+    # retried, depends on the release
+    exporter = OTLPSpanExporter(endpoint=endpoint, timeout=5)
+
+    print(f"📡 Exporting spans to: {endpoint}")
+    return BatchingSpanProcessor(exporter)
@@ -0,0 +1,182 @@
+"""
+Tests for the live metrics hub and /metrics/stream
+Run from packages/monitoring: python -m pytest -q
+"""
+
+import pytest
+from metrics_stream import MetricsHub, load_baseline
+import importlib
+import json
+import sqlite3
+import threading
+import time
+
+def parse_event(frame):
+    """Split an SSE frame into (event name, data)"""
+    lines = dict(line.split(": ", 1) for line in frame.strip().split("\n"))
+    return lines['event'], json.loads(lines['data'])
+
+def test_snapshot_then_coalesced_delta():
+    hub = MetricsHub(coalesce_interval_s=0.2, keepalive_interval_s=5)
+    assert hub.try_subscribe()
+    stream = hub.stream()
+
+    name, snapshot = parse_event(next(stream))
+    assert name == 'snapshot'
+    assert snapshot['metrics']['total_requests'] == 0
+
+    def publish():
+        for i in range(10):
+            hub.publish_trace({'trace_id': str(i), 'latency_ms': 100, 'error': 'boom' if i == 3 else ''})
+            time.sleep(0.005)
+
+    publisher = threading.Thread(target=publish)
+    publisher.start()
+    publisher.join()
+
+    name, delta = parse_event(next(stream))
+    assert name == 'delta'
+    assert delta['new_requests'] == 10
+    assert delta['new_errors'] == 1
+    assert delta['latency_buckets'] == {'le_250': 10}
+    assert [error['trace_id'] for error in delta['errors']] == ['3']
+    assert delta['metrics']['error_rate'] == 10.0
+
+    stream.close()
+    hub.release()
+
+def test_keepalive_when_idle():
+    hub = MetricsHub(keepalive_interval_s=0.05)
+    assert hub.try_subscribe()
+    stream = hub.stream()
+    next(stream)
+
+    assert next(stream) == ": keepalive\n\n"
+
+    stream.close()
+    hub.release()
+
+def test_slot_released_even_if_stream_never_started():
+    hub = MetricsHub(max_clients=1)
+    assert hub.try_subscribe()
+    assert not hub.try_subscribe()
+
+    stream = hub.stream()
+    stream.close()
+    hub.release()
+
+    assert hub.snapshot()['clients'] == 0
+    assert hub.try_subscribe()
+
+def test_head_request_does_not_leak_slot(tmp_path, monkeypatch):
+    pytest.importorskip("flask_cors")
+    monkeypatch.chdir(tmp_path)
+    server = importlib.import_module("lightweight_server")
+    client = server.app.test_client()
+
+    for _ in range(3):
+        response = client.head('/metrics/stream')
+        assert response.status_code == 200
+        response.close()
+
+    assert server.metrics_hub.snapshot()['clients'] == 0
+
+def log_and_publish(monitor, hub, trace_data):
+    """Ingest a trace the way the /log_trace handler does"""
+    replaced = monitor.log_trace(trace_data)
+    hub.publish_trace(trace_data, replaced)
+
+def assert_hub_matches_table(hub, monitor):
+    """Live totals must equal a fresh baseline and what /metrics reports"""
+    fresh = MetricsHub(load_baseline(monitor.db_path)).snapshot()
+    live = hub.snapshot()
+    assert live['metrics'] == fresh['metrics']
+    assert live['latency_buckets'] == fresh['latency_buckets']
+
+    metrics = monitor.get_metrics()
+    for key in ('total_requests', 'avg_latency_ms', 'error_rate', 'avg_sources_used'):
+        assert live['metrics'][key] == metrics[key]
+
+def test_bad_fields_count_the_same_live_and_after_restart(tmp_path, monkeypatch):
+    pytest.importorskip("flask_cors")
+    monkeypatch.chdir(tmp_path)
+    server = importlib.import_module("lightweight_server")
+    monitor = server.LightweightMonitor()
+    hub = MetricsHub(load_baseline(monitor.db_path))
+
+    log_and_publish(monitor, hub, {'trace_id': 'a', 'latency_ms': 120, 'sources_count': '3'})
+    log_and_publish(monitor, hub, {'trace_id': 'b', 'latency_ms': 'slow', 'sources_count': None})
+    log_and_publish(monitor, hub, {'trace_id': 'c', 'latency_ms': True, 'error': 0})
+
+    assert_hub_matches_table(hub, monitor)
+    assert hub.snapshot()['metrics'] == {
+        'total_requests': 3,
+        'avg_latency_ms': 60.5,
+        'error_rate': 33.33,
+        'avg_sources_used': 3.0,
+    }
+
+def test_replaced_trace_is_not_counted_twice(tmp_path, monkeypatch):
+    pytest.importorskip("flask_cors")
+    monkeypatch.chdir(tmp_path)
+    server = importlib.import_module("lightweight_server")
+    monitor = server.LightweightMonitor()
+
+    # A row stored before ingest was normalized keeps its TEXT latency
+    conn = sqlite3.connect(monitor.db_path)
+    conn.execute("INSERT INTO traces (id, latency_ms, sources_count, error) VALUES ('old', 'slow', 0, 'boom')")
+    conn.commit()
+    conn.close()
+    hub = MetricsHub(load_baseline(monitor.db_path))
+
+    log_and_publish(monitor, hub, {'trace_id': 'a', 'latency_ms': 100, 'error': 'boom'})
+    log_and_publish(monitor, hub, {'trace_id': 'a', 'latency_ms': 3000})
+    log_and_publish(monitor, hub, {'trace_id': 'old', 'latency_ms': 400})
+
+    assert_hub_matches_table(hub, monitor)
+    snapshot = hub.snapshot()
+    assert snapshot['metrics']['total_requests'] == 2
+    assert snapshot['metrics']['error_rate'] == 0.0
+    assert snapshot['latency_buckets']['le_500'] == 1
+    assert snapshot['latency_buckets']['le_5000'] == 1
+    assert snapshot['latency_buckets']['gt_10000'] == 0
+
+def test_baseline_matches_traces_table(tmp_path):
+    db_path = str(tmp_path / "traces.db")
+    conn = sqlite3.connect(db_path)
+    conn.execute("""
+        CREATE TABLE traces (id TEXT PRIMARY KEY, timestamp TEXT, question TEXT,
+                             tools_used TEXT, sources_count INTEGER, response_length INTEGER,
+                             latency_ms INTEGER, error TEXT, metadata TEXT)
+    """)
+    conn.execute("INSERT INTO traces VALUES ('a', '', 'q', '[]', 3, 10, 300, '', '{}')")
+    conn.execute("INSERT INTO traces VALUES ('b', '', 'q', '[]', 0, 10, 20000, 'boom', '{}')")
+    conn.commit()
+    conn.close()
+
+    hub = MetricsHub(load_baseline(db_path))
+
+    snapshot = hub.snapshot()
+    assert snapshot['metrics'] == {
+        'total_requests': 2,
+        'avg_latency_ms': 10150.0,
+        'error_rate': 50.0,
+        'avg_sources_used': 3.0,
+    }
+    assert snapshot['latency_buckets']['le_500'] == 1
+    assert snapshot['latency_buckets']['gt_10000'] == 1
+
+def test_failed_insert_releases_write_lock(tmp_path, monkeypatch):
+    pytest.importorskip("flask_cors")
+    monkeypatch.chdir(tmp_path)
+    server = importlib.import_module("lightweight_server")
+    monitor = server.LightweightMonitor()
+
+    with pytest.raises(sqlite3.Error):
+        monitor.log_trace({'trace_id': 'bad', 'question': {'not': 'text'}})
+
+    # Another writer must get the lock straight away
+    conn = sqlite3.connect(monitor.db_path, timeout=0)
+    conn.execute("BEGIN IMMEDIATE")
+    conn.rollback()
+    conn.close()
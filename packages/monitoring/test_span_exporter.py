@@ -0,0 +1,215 @@
+"""
+Tests for batched background span export
+Run from packages/monitoring: python -m pytest -q
+"""
+
+import pytest
+
+pytest.importorskip("opentelemetry.exporter.otlp.proto.http")
+
+from opentelemetry.sdk.trace import TracerProvider
+from opentelemetry.sdk.trace.export import SimpleSpanProcessor, SpanExporter, SpanExportResult
+from opentelemetry.sdk.trace.export.in_memory_span_exporter import InMemorySpanExporter
+from opentelemetry.trace import StatusCode
+from span_exporter import BatchingSpanProcessor, build_trace_span
+from datetime import datetime, timezone
+import importlib
+import threading
+import time
+
+class FakeExporter(SpanExporter):
+    def __init__(self, results=None):
+        """Record exported batches; results is a list of outcomes to return in order"""
+        self.batches = []
+        self.results = list(results or [])
+        self.entered = threading.Event()
+        self.release = threading.Event()
+        self.release.set()
+
+    def export(self, spans):
+        self.entered.set()
+        self.release.wait()
+        self.batches.append(list(spans))
+        outcome = self.results.pop(0) if self.results else SpanExportResult.SUCCESS
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+    def shutdown(self):
+        self.release.set()
+
+def wait_for(condition, timeout=2.0):
+    """Poll until condition() is true or the timeout passes"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.01)
+    return condition()
+
+def test_flushes_when_batch_is_full():
+    exporter = FakeExporter()
+    processor = BatchingSpanProcessor(exporter, max_batch_size=5, flush_interval_s=60)
+    try:
+        for i in range(5):
+            processor.on_end(f"span-{i}")
+
+        assert wait_for(lambda: processor.get_stats()['spans_exported'] == 5)
+        assert exporter.batches == [[f"span-{i}" for i in range(5)]]
+    finally:
+        processor.shutdown()
+
+def test_flushes_partial_batch_after_interval():
+    exporter = FakeExporter()
+    processor = BatchingSpanProcessor(exporter, max_batch_size=100, flush_interval_s=0.3)
+    try:
+        processor.on_end("span-0")
+        processor.on_end("span-1")
+
+        time.sleep(0.1)
+        assert exporter.batches == []
+
+        assert wait_for(lambda: processor.get_stats()['spans_exported'] == 2)
+        assert exporter.batches == [["span-0", "span-1"]]
+    finally:
+        processor.shutdown()
+
+def test_drops_spans_when_queue_is_full():
+    exporter = FakeExporter()
+    exporter.release.clear()
+    processor = BatchingSpanProcessor(exporter, max_queue_size=4, max_batch_size=1, flush_interval_s=60)
+    try:
+        # Park the worker inside export so nothing leaves the queue
+        processor.on_end("in-flight")
+        assert exporter.entered.wait(2)
+
+        started = time.monotonic()
+        for i in range(10):
+            processor.on_end(f"span-{i}")
+        assert time.monotonic() - started < 0.5
+
+        stats = processor.get_stats()
+        assert stats['queue_size'] == 4
+        assert stats['spans_dropped'] == 6
+    finally:
+        exporter.release.set()
+        processor.shutdown()
+
+    assert processor.get_stats()['spans_exported'] == 5
+
+def test_failed_batch_is_not_retried_and_worker_moves_on():
+    exporter = FakeExporter([SpanExportResult.FAILURE, ConnectionError("collector down")])
+    processor = BatchingSpanProcessor(exporter, max_batch_size=2, flush_interval_s=60)
+    try:
+        for i in range(6):
+            processor.on_end(f"span-{i}")
+        assert processor.force_flush(2000)
+
+        stats = processor.get_stats()
+        assert len(exporter.batches) == 3
+        assert stats['batches_failed'] == 2
+        assert stats['spans_failed'] == 4
+        assert stats['spans_exported'] == 2
+        assert stats['last_error'] == "collector down"
+    finally:
+        processor.shutdown()
+
+def test_shutdown_drains_queue():
+    exporter = FakeExporter()
+    processor = BatchingSpanProcessor(exporter, max_batch_size=100, flush_interval_s=60)
+    for i in range(3):
+        processor.on_end(f"span-{i}")
+
+    processor.shutdown()
+    processor.on_end("late")
+
+    assert exporter.batches == [["span-0", "span-1", "span-2"]]
+    assert processor.get_stats()['spans_enqueued'] == 3
+
+def in_memory_tracer():
+    """Tracer whose finished spans land in an InMemorySpanExporter"""
+    exporter = InMemorySpanExporter()
+    provider = TracerProvider()
+    provider.add_span_processor(SimpleSpanProcessor(exporter))
+    return provider.get_tracer("test"), exporter
+
+def test_span_ends_at_trace_timestamp():
+    tracer, exporter = in_memory_tracer()
+
+    build_trace_span(tracer, "trace-1", {
+        'timestamp': '2025-06-13T10:00:05.000Z',
+        'latency_ms': '1500',
+        'question': 'Solar in Cebu?',
+        'tools_used': ['query_qdrant_db', 'search_philippines_energy'],
+        'sources_count': 5,
+        'metadata': {'model': 'claude'},
+    })
+
+    [span] = exporter.get_finished_spans()
+    end = datetime(2025, 6, 13, 10, 0, 5, tzinfo=timezone.utc)
+    assert span.end_time == int(end.timestamp() * 1e9)
+    assert span.end_time - span.start_time == 1500 * 1_000_000
+    assert span.status.status_code == StatusCode.OK
+    assert span.attributes['input.value'] == 'Solar in Cebu?'
+    assert span.attributes['energy_advisor.trace_id'] == 'trace-1'
+    assert span.attributes['energy_advisor.latency_ms'] == 1500
+    assert span.attributes['energy_advisor.sources_count'] == 5
+    assert list(span.attributes['energy_advisor.tools_used']) == [
+        'query_qdrant_db', 'search_philippines_energy'
+    ]
+    assert span.attributes['metadata'] == '{"model": "claude"}'
+
+def test_span_marks_errors_and_tolerates_missing_fields():
+    tracer, exporter = in_memory_tracer()
+
+    before = time.time_ns()
+    build_trace_span(tracer, "trace-2", {'error': 'timeout', 'tools_used': None, 'latency_ms': 'slow'})
+    build_trace_span(tracer, "trace-3", {'tools_used': 'search_philippines_energy', 'question': None})
+
+    failed, single_tool = exporter.get_finished_spans()
+    assert failed.status.status_code == StatusCode.ERROR
+    assert failed.status.description == 'timeout'
+    assert list(failed.attributes['energy_advisor.tools_used']) == []
+    assert failed.start_time == failed.end_time >= before
+    assert list(single_tool.attributes['energy_advisor.tools_used']) == ['search_philippines_energy']
+    assert single_tool.attributes['input.value'] == ''
+
+def test_build_failures_count_as_dropped():
+    processor = BatchingSpanProcessor(FakeExporter(), flush_interval_s=60)
+    try:
+        processor.on_end("span-0")
+        processor.record_build_failure("bad trace")
+
+        stats = processor.get_stats()
+        assert stats['spans_build_failed'] == 1
+        assert stats['last_error'] == "bad trace"
+        assert stats['drop_rate'] == 50.0
+    finally:
+        processor.shutdown()
+
+def test_log_trace_emits_span_and_survives_build_failure(tmp_path, monkeypatch):
+    pytest.importorskip("phoenix")
+    monkeypatch.chdir(tmp_path)
+    phoenix_monitor = importlib.import_module("phoenix_monitor")
+
+    # Skip __init__ so no Phoenix app is launched
+    monitor = phoenix_monitor.EnergyAdvisorMonitor.__new__(phoenix_monitor.EnergyAdvisorMonitor)
+    monitor.db_path = str(tmp_path / "traces.db")
+    monitor.span_processor = BatchingSpanProcessor(FakeExporter(), flush_interval_s=60)
+    monitor.tracer, exporter = in_memory_tracer()
+    monitor.init_database()
+
+    try:
+        monitor.log_trace({'trace_id': 'a', 'latency_ms': 200, 'tools_used': None})
+        [span] = exporter.get_finished_spans()
+        assert span.attributes['energy_advisor.trace_id'] == 'a'
+
+        class BrokenTracer:
+            def start_span(self, *args, **kwargs):
+                raise RuntimeError("tracer unavailable")
+
+        monitor.tracer = BrokenTracer()
+        monitor.log_trace({'trace_id': 'b', 'latency_ms': 200})
+        assert monitor.span_processor.get_stats()['spans_build_failed'] == 1
+    finally:
+        monitor.span_processor.shutdown()